@@ -1,12 +1,35 @@
+import bisect
 import cutie
 from enum import Enum
 import os
+import sys
 import datetime
-import pandas as pd
+import locale
+import openpyxl
 import configparser
 from markdown_pdf import MarkdownPdf, Section
 
+MD_BUFFER_SIZE = 1 << 16
+
+ROW_LAYOUT = (
+  'ID',
+  'Автор',
+  'Дата и время нахождения',
+  'Приоритет',
+  'Важность',
+  'Статус',
+  'Местонахождение',
+  'Тип',
+  'Краткое описание',
+  'Ожидание',
+  'Реальность',
+  'Шаги воспроизведения',
+)
+
+
 class HumanReadableEnum(Enum):
+  __slots__ = ('human_readable',)
+
   def __new__(cls, *args):
     value = len(cls.__members__) + 1
     obj = object.__new__(cls)
@@ -16,6 +39,13 @@ class HumanReadableEnum(Enum):
   def __init__(self, human_readable = 'unknown'):
     self.human_readable = human_readable
 
+  @classmethod
+  def select_options(cls) -> tuple[list, list[str]]:
+    if '_labels' not in cls.__dict__:
+      cls._members = list(cls)
+      cls._labels = [v.human_readable for v in cls._members]
+    return cls._members, cls._labels
+
 
 class Priority(HumanReadableEnum):
   IMMEDIATELY = 'Исправить немедленно'
@@ -53,28 +83,31 @@ class BugReport:
   seveirty: Severity
 
   def __str__(self):
-    result = ""
-    result += f'# Инцидент {self.id}: {self.brief}\n\n'
-    result += f'**Приоритет:** {self.priority.human_readable}\n\n'
-    result += f'**Важность:** {self.seveirty.human_readable}\n\n'
-    result += f'**Статус:** {self.status.human_readable}\n\n'
-    result += f'**Где находится:** {self.section}\n\n'
-    result += f'**Тип:** {self.type}\n\n'
-    result += f'**Время обнаружения**: {self.creation_datetime}\n\n'
-    result += f'**Автор:** {self.author}\n\n'
-    result += '-' * 20 + '\n\n'
-    result += f'## Ожидание\n\n'
-    result += f'{self.expected}\n\n'
-    result += f'## Реальность\n\n'
-    result += f'{self.actual}\n\n'
-    result += f'## Шаги воспроизведения\n\n'
+    return ''.join(self.to_md_parts())
+
+  def to_md_parts(self) -> list[str]:
+    parts: list[str] = []
+    parts.append(f'# Инцидент {self.id}: {self.brief}\n\n')
+    parts.append(f'**Приоритет:** {self.priority.human_readable}\n\n')
+    parts.append(f'**Важность:** {self.seveirty.human_readable}\n\n')
+    parts.append(f'**Статус:** {self.status.human_readable}\n\n')
+    parts.append(f'**Где находится:** {self.section}\n\n')
+    parts.append(f'**Тип:** {self.type}\n\n')
+    parts.append(f'**Время обнаружения**: {self.creation_datetime}\n\n')
+    parts.append(f'**Автор:** {self.author}\n\n')
+    parts.append('-' * 20 + '\n\n')
+    parts.append(f'## Ожидание\n\n')
+    parts.append(f'{self.expected}\n\n')
+    parts.append(f'## Реальность\n\n')
+    parts.append(f'{self.actual}\n\n')
+    parts.append(f'## Шаги воспроизведения\n\n')
     if len(self.reproduction_steps) != 0:
-      for i, value in enumerate(self.reproduction_steps):
-        result += f'{i + 1}. {value}\n'
-      result += '\n'
+      for i, value in enumerate(self.reproduction_steps, start=1):
+        parts.append(f'{i}. {value}\n')
+      parts.append('\n')
     else:
-      result += f'Шаги воспроизведения не указаны! Сообщите {self.author}\n\n'
-    return result
+      parts.append(f'Шаги воспроизведения не указаны! Сообщите {self.author}\n\n')
+    return parts
 
 
 def main():
@@ -83,36 +116,59 @@ def main():
   xlsx = config['core']['xlsx']
   output_md = config['core']['output.md']
 
-  df = init_from_xlsx(xlsx)
-  locations = set(df['Местонахождение'])
-  types = set(df['Тип'])
+  next_id, locations, types = init_from_xlsx(xlsx)
+  md_sections = load_md_sections(output_md)
+  new_rows: list[tuple] = []
+  locations_sorted = sorted(locations)
+  types_sorted = sorted(types)
   while True:
     try:
-      next_id = generate_next_id(df)
-      bug_report = prompt_bug_report(next_id, author, locations, types)
-      locations.add(bug_report.section)
-      types.add(bug_report.type)
-      add_bug_report_to_data_frame(df, bug_report)
-      output_md_filename = write_to_md_file(bug_report, output_md)
+      bug_report = prompt_bug_report(next_id, author, locations_sorted, types_sorted)
+      next_id += 1
+      add_variant(locations, locations_sorted, bug_report.section)
+      add_variant(types, types_sorted, bug_report.type)
+      add_bug_report_to_rows(new_rows, bug_report)
+      md_text = str(bug_report)
+      output_md_filename = write_to_md_file(md_text, bug_report, output_md)
+      md_sections[os.path.basename(output_md_filename)] = md_text
       print(f'Отчёт записан в \'{output_md_filename}\'')
     except KeyboardInterrupt:
       break
-  write_to_xlsx_file(df, xlsx)
-  compile_to_pdf_report(output_md)
+  write_to_xlsx_file(new_rows, xlsx)
+  compile_to_pdf_report(md_sections, output_md)
 
 
-def compile_to_pdf_report(output_md):
-  pdf = MarkdownPdf(toc_level=1)
+def load_md_sections(output_md) -> dict[str, str]:
+  md_sections: dict[str, str] = {}
   files = os.listdir(output_md)
   files = filter(is_valid_bug_report_file_name, files)
-  files = sorted(files, key=get_id_from_file_name)
   for file in files:
-    file = os.path.join(output_md, file)
-    if not (os.path.isfile(file) and os.path.splitext(file)[1] == '.md' and os.path.basename(file).startswith('BR')):
+    path = os.path.join(output_md, file)
+    if not (os.path.isfile(path) and os.path.splitext(path)[1] == '.md' and os.path.basename(path).startswith('BR')):
       continue
-    with open(file, 'r') as md:
-      text = md.read()
-      pdf.add_section(Section(text))
+    md_sections[file] = read_md_file(path)
+  return md_sections
+
+
+def read_md_file(path: str) -> str:
+  try:
+    with open(path, 'r', encoding='utf-8', buffering=MD_BUFFER_SIZE) as md:
+      return md.read()
+  except UnicodeDecodeError:
+    with open(path, 'r', encoding=locale.getpreferredencoding(False), errors='replace', buffering=MD_BUFFER_SIZE) as md:
+      return md.read()
+
+
+def add_variant(variants: set[str], variants_sorted: list[str], value: str) -> None:
+  if value not in variants:
+    variants.add(value)
+    bisect.insort(variants_sorted, value)
+
+
+def compile_to_pdf_report(md_sections: dict[str, str], output_md):
+  pdf = MarkdownPdf(toc_level=1)
+  for file in sorted(md_sections, key=get_id_from_file_name):
+    pdf.add_section(Section(md_sections[file]))
   output_pdf_filename = os.path.join(output_md, 'all_bugs_report.pdf')
   pdf.save(output_pdf_filename)
 
@@ -129,8 +185,8 @@ def get_id_from_file_name(file_name: str) -> int:
   return 0
 
 
-def add_bug_report_to_data_frame(df, bug_report):
-  df.loc[len(df.index)] = [
+def add_bug_report_to_rows(rows: list[tuple], bug_report: BugReport) -> None:
+  rows.append((
     bug_report.id,
     bug_report.author,
     bug_report.creation_datetime,
@@ -142,14 +198,8 @@ def add_bug_report_to_data_frame(df, bug_report):
     bug_report.brief,
     bug_report.expected,
     bug_report.actual,
-    '\n'.join([f'{i}. {v}' for i, v in enumerate(bug_report.reproduction_steps)])
-  ]
-
-
-def generate_next_id(df):
-  ids = df.get('ID')
-  next_id = 1 if len(ids) == 0 else max(ids) + 1
-  return next_id
+    '\n'.join(f'{i}. {v}' for i, v in enumerate(bug_report.reproduction_steps, start=1))
+  ))
 
 
 def init_from_ini() -> configparser.ConfigParser:
@@ -162,14 +212,14 @@ def init_from_ini() -> configparser.ConfigParser:
     need_changes = True
     config.add_section('core')
 
-  for option, default_value, prompt_label in (
-    ('author', os.getlogin(), 'Установите имя:'),
-    ('xlsx', os.path.join(os.getcwd(), 'bugs.xlsx'), 'Введите путь до Excel БД:'),
-    ('output.md', os.getcwd(), 'Папка для сохранения отчётов')
+  for option, default_factory, prompt_label in (
+    ('author', os.getlogin, 'Установите имя:'),
+    ('xlsx', lambda : os.path.join(os.getcwd(), 'bugs.xlsx'), 'Введите путь до Excel БД:'),
+    ('output.md', os.getcwd, 'Папка для сохранения отчётов')
     ):
     if not config.has_option('core', option) or config.get('core', option) == '':
       need_changes = True
-      value = prompt(prompt_label, required=False, default_value=default_value)
+      value = prompt(prompt_label, required=False, default_value=default_factory())
       config.set('core', option, value)
   if need_changes:
     with open('.ini', 'w') as ini:
@@ -177,28 +227,35 @@ def init_from_ini() -> configparser.ConfigParser:
   return config
 
 
-def init_from_xlsx(xlsx) -> pd.DataFrame:
-  if os.path.exists(xlsx):
-    df = pd.read_excel(xlsx)
-    return df
-  else:
-    return pd.DataFrame(columns=[
-      'ID',
-      'Автор',
-      'Дата и время нахождения',
-      'Приоритет',
-      'Важность',
-      'Статус',
-      'Местонахождение',
-      'Тип',
-      'Краткое описание',
-      'Ожидание',
-      'Реальность',
-      'Шаги воспроизведения',
-    ])
-
-
-def prompt_bug_report(next_id: int, author: str, locations: set[str], types: set[str]) -> BugReport:
+def init_from_xlsx(xlsx) -> tuple[int, set[str], set[str]]:
+  next_id = 1
+  locations: set[str] = set()
+  types: set[str] = set()
+  if not os.path.exists(xlsx):
+    return next_id, locations, types
+  wb = openpyxl.load_workbook(xlsx, read_only=True, data_only=True)
+  try:
+    ws = wb.worksheets[0]
+    ws.reset_dimensions()
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, ())
+    id_column = header.index('ID')
+    location_column = header.index('Местонахождение')
+    type_column = header.index('Тип')
+    for row in rows:
+      row += (None,) * (len(header) - len(row))
+      if row[id_column] is not None:
+        next_id = max(next_id, int(row[id_column]) + 1)
+      if row[location_column] is not None:
+        locations.add(str(row[location_column]))
+      if row[type_column] is not None:
+        types.add(str(row[type_column]))
+  finally:
+    wb.close()
+  return next_id, locations, types
+
+
+def prompt_bug_report(next_id: int, author: str, locations: list[str], types: list[str]) -> BugReport:
   bug_report = BugReport()
   bug_report.id = next_id
   bug_report.author = author
@@ -216,10 +273,10 @@ def prompt_bug_report(next_id: int, author: str, locations: set[str], types: set
   return bug_report
 
 
-def write_to_md_file(bug_report: BugReport, output_dir: str) -> str:
+def write_to_md_file(md_text: str, bug_report: BugReport, output_dir: str) -> str:
   filename = os.path.join(output_dir, generate_md_filename(bug_report))
-  with open(filename, 'w') as output:
-    output.write(str(bug_report))
+  with open(filename, 'w', encoding='utf-8', buffering=MD_BUFFER_SIZE) as output:
+    output.write(md_text)
   return filename
 
 
@@ -227,15 +284,41 @@ def generate_md_filename(bug_report: BugReport) -> str:
   return f'BR-{bug_report.id}-{bug_report.priority.value}{bug_report.seveirty.value}.md'
 
 
-def write_to_xlsx_file(df: pd.DataFrame, filename: str) -> None:
-  df.to_excel(filename, index=False)
+def write_to_xlsx_file(rows: list[tuple], filename: str) -> None:
+  exists = os.path.exists(filename)
+  if exists and len(rows) == 0:
+    return
+  output = openpyxl.Workbook(write_only=True)
+  if exists:
+    source = openpyxl.load_workbook(filename, read_only=True)
+    try:
+      source_ws = source.worksheets[0]
+      source_ws.reset_dimensions()
+      ws = output.create_sheet(source_ws.title)
+      for row in source_ws.iter_rows(values_only=True):
+        ws.append(row)
+    finally:
+      source.close()
+  else:
+    ws = output.create_sheet('Sheet1')
+    ws.append(ROW_LAYOUT)
+  for row in rows:
+    ws.append(row)
+  tmp_filename = filename + '.tmp'
+  try:
+    output.save(tmp_filename)
+  except Exception:
+    if os.path.exists(tmp_filename):
+      os.remove(tmp_filename)
+    raise
+  os.replace(tmp_filename, filename)
 
 
 def prompt(label: str, required: bool = True, default_value: str = '') -> str:
   if not required and default_value != '':
     label = label.removesuffix(':')
     label = label + f' (По умолчанию {default_value})' + ':'
-  print(label, end=" ")
+  sys.stdout.write(f'{label} ')
   value = input().strip()
   while required and value == '':
     print_error('Обязательное значение', len(label))
@@ -247,10 +330,10 @@ def prompt(label: str, required: bool = True, default_value: str = '') -> str:
 
 def prompt_brief() -> str:
   result = prompt('Краткое описание бага:')
-  words = result.split()
-  if 0 <= len(words) <= 3:
+  words = len(result.split())
+  if words <= 3:
     print_warning('Слишком короткое описание')
-  elif 10 < len(words):
+  elif 10 < words:
     print_warning('Слишком длинное описание')
   return result
 
@@ -269,18 +352,15 @@ def prompt_list(label: str, ordered: bool = True) -> list[str]:
 
 
 def prompt_select(label: str, source_enum: HumanReadableEnum) -> Enum:
-  t = [v for v in source_enum]
-  values = [v.human_readable for v in source_enum]
+  members, labels = source_enum.select_options()
   print(label)
-  return t[cutie.select(values)]
+  return members[cutie.select(labels)]
 
 
-def prompt_with_old_variants(label: str, old_variants: set[str]) -> str:
+def prompt_with_old_variants(label: str, old_variants: list[str]) -> str:
   if len(old_variants) == 0:
     return prompt(label)
-  t = [v for v in old_variants]
-  t.sort()
-  t.insert(0, '>> Другое')
+  t = ['>> Другое', *old_variants]
   print(label)
   selected = cutie.select(t)
   if selected == 0:
@@ -294,9 +374,8 @@ def print_warning(text: str) -> None:
 
 
 def print_error(text: str, label_length: int = 0) -> None:
-  print('\033[A', end='')
-  print(f'\033[{label_length - 2}C', end='')
-  print(f' \033[31m({text})\033[0m: ', end='')
+  sys.stdout.write(f'\033[A\033[{label_length - 2}C \033[31m({text})\033[0m: ')
+  sys.stdout.flush()
 
 
 if __name__ == "__main__":